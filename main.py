@@ -1,28 +1,77 @@
 import os
 import logging
 import asyncio
-import psycopg2
-import pandas as pd
+import asyncpg
+import hashlib
+import hmac
+import html
+import orjson
 import re
+import redis.asyncio as aioredis
+import secrets
 from datetime import datetime
+from cachetools import TTLCache
+from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import ORJSONResponse
 import uvicorn
-from threading import Thread
 
 # Configuração
 logging.basicConfig(level=logging.INFO)
+load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL")
 PORT = int(os.getenv("PORT", 8000))
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 4))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 20))
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", 5000))
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", 30))
+REDIS_URL = os.getenv("REDIS_URL")
+REDIS_CACHE_TTL = int(os.getenv("REDIS_CACHE_TTL", 120))
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", 0.5))
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip('/')
+# Sem TG_SECRET, gera um segredo aleatório para o webhook a cada início
+TG_SECRET = os.getenv("TG_SECRET") or secrets.token_urlsafe(32)
+
+MENTION_RE = re.compile(r'@(\w+)')
 
 # Ajustar DATABASE_URL para Railway
 if DATABASE_URL and DATABASE_URL.startswith('postgres://'):
     DATABASE_URL = DATABASE_URL.replace('postgres://', 'postgresql://', 1)
 
+def esc(value):
+    """Escapa um valor dinâmico para parse_mode HTML"""
+    return html.escape(str(value))
+
+# Formatação das linhas de resultado
+USER_SEPARATOR = "\n" + "─" * 20 + "\n"
+
+def format_user_row(idx, row):
+    """Bloco de um usuário no /search"""
+    return f"""
+👤 <b>Usuário {idx+1}:</b>
+🆔 ID: <code>{row['id']}</code>
+📛 @{esc(row['username'])}
+👤 Nome: {esc(row['first_name'])} {esc(row['last_name'] or '')}
+📞 Telefone: {esc(row['phone'] or 'Não disponível')}
+                """ + USER_SEPARATOR
+
+def format_phone_row(idx, row):
+    """Linha de um telefone no /phones"""
+    return f"<b>{idx+1}.</b> 📱 {esc(row['phone'])}\n💬 {esc(row['text'][:60])}...\n📁 {esc(row['chat_title'])}\n\n"
+
+def format_network_row(idx, row):
+    """Linha de uma conexão no /network"""
+    return f"<b>{idx+1}.</b> @{esc(row['username'])} - {row['msg_count']} msgs\n"
+
+def format_mention_row(row):
+    """Linha de um usuário encontrado por menção"""
+    return f"👤 @{esc(row['username'])}\n🆔 <code>{row['id']}</code>\n📊 <code>/analyze {row['id']}</code>\n\n"
+
 # FastAPI App
-app = FastAPI(title="Telegram Investigator Bot")
+app = FastAPI(title="Telegram Investigator Bot", default_response_class=ORJSONResponse)
 
 @app.get("/")
 async def root():
@@ -36,17 +85,105 @@ async def health():
 class TelegramInvestigatorBot:
     def __init__(self, token):
         self.token = token
-        self.application = Application.builder().token(token).build()
+        self.pool = None
+        self.pool_lock = asyncio.Lock()
+        self.heavy_queries = None
+        self.redis = None
+        self.cache = TTLCache(maxsize=1024, ttl=RESULT_CACHE_TTL) if RESULT_CACHE_TTL > 0 else None
+        self.application = (
+            Application.builder()
+            .token(token)
+            .concurrent_updates(True)
+            .build()
+        )
         self.setup_handlers()
     
-    def get_db_connection(self):
-        """Conexão com o banco"""
-        try:
-            conn = psycopg2.connect(DATABASE_URL)
-            return conn
-        except Exception as e:
-            logging.error(f"Erro DB: {e}")
-            return None
+    async def open_pool(self):
+        """Cria o pool de conexões (e o cliente Redis)"""
+        if REDIS_URL:
+            self.redis = aioredis.from_url(
+                REDIS_URL,
+                socket_timeout=REDIS_TIMEOUT,
+                socket_connect_timeout=REDIS_TIMEOUT
+            )
+        
+        await self.ensure_pool()
+    
+    async def ensure_pool(self):
+        """Garante o pool de conexões, tentando de novo se o banco estava fora"""
+        if self.pool:
+            return True
+        
+        async with self.pool_lock:
+            if self.pool:
+                return True
+            try:
+                self.pool = await asyncpg.create_pool(
+                    DATABASE_URL,
+                    min_size=DB_POOL_MIN,
+                    max_size=DB_POOL_MAX,
+                    timeout=10,
+                    command_timeout=10,
+                    statement_cache_size=256,
+                    max_cached_statement_lifetime=300,
+                    server_settings={"statement_timeout": str(DB_STATEMENT_TIMEOUT)}
+                )
+                # Reserva conexões para as buscas simples
+                self.heavy_queries = asyncio.Semaphore(max(1, DB_POOL_MAX - 2))
+            except Exception as e:
+                logging.error(f"Erro DB: {e}")
+                self.pool = None
+            return self.pool is not None
+    
+    async def close_pool(self):
+        """Fecha o pool de conexões"""
+        if self.pool:
+            await self.pool.close()
+            self.pool = None
+        if self.redis:
+            await self.redis.aclose()
+            self.redis = None
+    
+    async def fetch(self, query, *args, heavy=False):
+        """Executa um SELECT reaproveitando resultados recentes do cache"""
+        key = (query, args)
+        if self.cache is not None:
+            rows = self.cache.get(key)
+            if rows is not None:
+                return rows
+        
+        if self.redis:
+            redis_key = "q:" + hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+            try:
+                cached = await self.redis.get(redis_key)
+            except Exception as e:
+                logging.error(f"Erro Redis: {e}")
+                cached = None
+            if cached is not None:
+                rows = orjson.loads(cached)
+                if self.cache is not None:
+                    self.cache[key] = rows
+                return rows
+        
+        if heavy:
+            async with self.heavy_queries:
+                rows = await self.pool.fetch(query, *args)
+        else:
+            rows = await self.pool.fetch(query, *args)
+        
+        if self.cache is not None:
+            self.cache[key] = rows
+        if self.redis:
+            payload = orjson.dumps(
+                [dict(row) for row in rows],
+                default=str,
+                option=orjson.OPT_PASSTHROUGH_DATETIME
+            )
+            try:
+                await self.redis.set(redis_key, payload, ex=REDIS_CACHE_TTL)
+            except Exception as e:
+                logging.error(f"Erro Redis: {e}")
+        return rows
     
     def setup_handlers(self):
         """Configura handlers do bot"""
@@ -62,73 +199,75 @@ class TelegramInvestigatorBot:
         
         for handler in handlers:
             self.application.add_handler(handler)
+        
+        # Ações dos botões inline (callback_data = "<ação>_<id>")
+        self.button_actions = {
+            'analyze': self._do_analyze,
+            'phones': self._do_phones,
+            'network': self._do_network
+        }
     
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Comando /start"""
         user = update.effective_user
         await update.message.reply_text(f"""
-👮 **BOT DE INVESTIGAÇÃO TELEGRAM**
+👮 <b>BOT DE INVESTIGAÇÃO TELEGRAM</b>
 
-Olá {user.first_name}! 
+Olá {esc(user.first_name)}! 
 
-**Comandos:**
-🔍 `/search @username` - Buscar usuário
-📊 `/analyze ID` - Análise completa  
-📞 `/phones ID` - Buscar telefones
-👥 `/network ID` - Analisar rede
+<b>Comandos:</b>
+🔍 <code>/search @username</code> - Buscar usuário
+📊 <code>/analyze ID</code> - Análise completa  
+📞 <code>/phones ID</code> - Buscar telefones
+👥 <code>/network ID</code> - Analisar rede
 
-**Exemplos:**
-`/search @username`
-`/analyze 123456789`
-`/phones 123456789` 
-`/network 123456789`
+<b>Exemplos:</b>
+<code>/search @username</code>
+<code>/analyze 123456789</code>
+<code>/phones 123456789</code> 
+<code>/network 123456789</code>
 
-💡 *Também funciona digitar @username diretamente*
-        """, parse_mode='Markdown')
+💡 <i>Também funciona digitar @username diretamente</i>
+        """, parse_mode='HTML')
     
     async def search_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Buscar usuário por @username"""
+        """Comando /search"""
         if not context.args:
-            await update.message.reply_text("❌ Use: `/search @username`", parse_mode='Markdown')
+            await update.message.reply_text("❌ Use: <code>/search @username</code>", parse_mode='HTML')
             return
         
-        username = context.args[0].replace('@', '')
-        await update.message.reply_text(f"🔍 Buscando @{username}...")
-        
-        conn = self.get_db_connection()
-        if not conn:
-            await update.message.reply_text("❌ Erro de conexão com o banco")
+        await self._do_search(update.message, context.args[0].replace('@', ''))
+    
+    async def _do_search(self, message, username):
+        """Buscar usuário por @username"""
+        if not await self.ensure_pool():
+            await message.reply_text("❌ Erro de conexão com o banco")
             return
         
+        # Aviso enviado em paralelo com a consulta
+        status = asyncio.create_task(message.reply_text(f"🔍 Buscando @{username}..."))
+        
         try:
             query = """
             SELECT id, username, first_name, last_name, phone 
             FROM users 
-            WHERE username ILIKE %s
+            WHERE username ILIKE $1
             LIMIT 10
             """
-            df = pd.read_sql_query(query, conn, params=[username])
-            conn.close()
+            rows = await self.fetch(query, username)
+            await status
             
-            if df.empty:
-                await update.message.reply_text(f"❌ Nenhum usuário encontrado para @{username}")
+            if not rows:
+                await message.reply_text(f"❌ Nenhum usuário encontrado para @{username}")
                 return
             
-            response = f"✅ **{len(df)} usuário(s) encontrado(s):**\n\n"
-            
-            for idx, row in df.iterrows():
-                user_info = f"""
-👤 **Usuário {idx+1}:**
-🆔 ID: `{row['id']}`
-📛 @{row['username']}
-👤 Nome: {row['first_name']} {row['last_name'] or ''}
-📞 Telefone: {row['phone'] or 'Não disponível'}
-                """
-                response += user_info + "\n" + "─" * 20 + "\n"
+            response = f"✅ <b>{len(rows)} usuário(s) encontrado(s):</b>\n\n" + "".join(
+                format_user_row(idx, row) for idx, row in enumerate(rows)
+            )
             
             # Botões de ação
             keyboard = []
-            for _, row in df.iterrows():
+            for row in rows:
                 keyboard.append([
                     InlineKeyboardButton(
                         f"🔍 Analisar {row['username']}", 
@@ -138,71 +277,78 @@ Olá {user.first_name}!
             
             reply_markup = InlineKeyboardMarkup(keyboard)
             
-            await update.message.reply_text(
+            await message.reply_text(
                 response, 
-                parse_mode='Markdown',
+                parse_mode='HTML',
                 reply_markup=reply_markup
             )
             
         except Exception as e:
-            conn.close()
-            await update.message.reply_text(f"❌ Erro: {str(e)}")
+            # O aviso precisa chegar antes da mensagem de erro
+            await asyncio.gather(status, return_exceptions=True)
+            await message.reply_text(f"❌ Erro: {str(e)}")
     
     async def analyze_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Análise completa do usuário"""
+        """Comando /analyze"""
         if not context.args:
-            await update.message.reply_text("❌ Use: `/analyze ID`", parse_mode='Markdown')
+            await update.message.reply_text("❌ Use: <code>/analyze ID</code>", parse_mode='HTML')
             return
         
-        user_id = context.args[0]
-        await update.message.reply_text(f"📊 Analisando usuário {user_id}...")
+        await self._do_analyze(update.message, context.args[0])
+    
+    async def _do_analyze(self, message, user_id):
+        """Análise completa do usuário"""
+        if not (user_id.isascii() and user_id.isdigit()):
+            await message.reply_text("❌ ID inválido")
+            return
         
-        conn = self.get_db_connection()
-        if not conn:
-            await update.message.reply_text("❌ Erro de conexão com o banco")
+        if not await self.ensure_pool():
+            await message.reply_text("❌ Erro de conexão com o banco")
             return
         
+        # Aviso enviado em paralelo com a consulta
+        status = asyncio.create_task(message.reply_text(f"📊 Analisando usuário {user_id}..."))
+        
         try:
-            # Dados básicos
-            user_query = "SELECT * FROM users WHERE id = %s"
-            user_df = pd.read_sql_query(user_query, conn, params=[user_id])
-            
-            if user_df.empty:
-                await update.message.reply_text("❌ Usuário não encontrado")
-                conn.close()
-                return
+            # Dados básicos + estatísticas em uma única consulta
+            query = """
+            SELECT u.*, s.total_messages, s.total_chats, s.first_message, s.last_message
+            FROM users u
+            LEFT JOIN LATERAL (
+                SELECT 
+                    COUNT(*) as total_messages,
+                    COUNT(DISTINCT chat_id) as total_chats,
+                    MIN(date) as first_message,
+                    MAX(date) as last_message
+                FROM messages WHERE user_id = u.id
+            ) s ON TRUE
+            WHERE u.id = $1
+            """
             
-            user_data = user_df.iloc[0]
+            rows = await self.fetch(query, int(user_id), heavy=True)
+            await status
             
-            # Estatísticas
-            stats_query = """
-            SELECT 
-                COUNT(*) as total_messages,
-                COUNT(DISTINCT chat_id) as total_chats,
-                MIN(date) as first_message,
-                MAX(date) as last_message
-            FROM messages WHERE user_id = %s
-            """
-            stats_df = pd.read_sql_query(stats_query, conn, params=[user_id])
-            stats = stats_df.iloc[0] if not stats_df.empty else {}
+            if not rows:
+                await message.reply_text("❌ Usuário não encontrado")
+                return
             
-            conn.close()
+            user_data = rows[0]
             
             # Montar resposta
             response = f"""
-🎯 **RELATÓRIO DE INVESTIGAÇÃO**
+🎯 <b>RELATÓRIO DE INVESTIGAÇÃO</b>
 
-👤 **DADOS BÁSICOS:**
-🆔 ID: `{user_data['id']}`
-📛 Username: @{user_data['username']}
-👤 Nome: {user_data['first_name']} {user_data['last_name'] or ''}
-📞 Telefone: {user_data['phone'] or 'Não disponível'}
+👤 <b>DADOS BÁSICOS:</b>
+🆔 ID: <code>{user_data['id']}</code>
+📛 Username: @{esc(user_data['username'])}
+👤 Nome: {esc(user_data['first_name'])} {esc(user_data['last_name'] or '')}
+📞 Telefone: {esc(user_data['phone'] or 'Não disponível')}
 
-📊 **ATIVIDADE:**
-💬 Total de mensagens: {stats.get('total_messages', 0)}
-👥 Grupos ativos: {stats.get('total_chats', 0)}
-📅 Primeira mensagem: {stats.get('first_message', 'N/A')}
-🕒 Última mensagem: {stats.get('last_message', 'N/A')}
+📊 <b>ATIVIDADE:</b>
+💬 Total de mensagens: {user_data['total_messages']}
+👥 Grupos ativos: {user_data['total_chats']}
+📅 Primeira mensagem: {user_data['first_message'] or 'N/A'}
+🕒 Última mensagem: {user_data['last_message'] or 'N/A'}
             """
             
             # Botões
@@ -212,194 +358,246 @@ Olá {user.first_name}!
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
             
-            await update.message.reply_text(
+            await message.reply_text(
                 response, 
-                parse_mode='Markdown',
+                parse_mode='HTML',
                 reply_markup=reply_markup
             )
             
         except Exception as e:
-            conn.close()
-            await update.message.reply_text(f"❌ Erro: {str(e)}")
+            # O aviso precisa chegar antes da mensagem de erro
+            await asyncio.gather(status, return_exceptions=True)
+            await message.reply_text(f"❌ Erro: {str(e)}")
     
     async def search_phones(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Buscar padrões de telefone"""
+        """Comando /phones"""
         if not context.args:
-            await update.message.reply_text("❌ Use: `/phones ID`", parse_mode='Markdown')
+            await update.message.reply_text("❌ Use: <code>/phones ID</code>", parse_mode='HTML')
             return
         
-        user_id = context.args[0]
-        await update.message.reply_text(f"📞 Buscando telefones...")
+        await self._do_phones(update.message, context.args[0])
+    
+    async def _do_phones(self, message, user_id):
+        """Buscar padrões de telefone"""
+        if not (user_id.isascii() and user_id.isdigit()):
+            await message.reply_text("❌ ID inválido")
+            return
         
-        conn = self.get_db_connection()
-        if not conn:
-            await update.message.reply_text("❌ Erro de conexão com o banco")
+        if not await self.ensure_pool():
+            await message.reply_text("❌ Erro de conexão com o banco")
             return
         
+        # Aviso enviado em paralelo com a consulta
+        status = asyncio.create_task(message.reply_text(f"📞 Buscando telefones..."))
+        
         try:
-            query = """
-            SELECT m.text, m.date, c.title as chat_title
+            query = r"""
+            SELECT (regexp_match(m.text, '\+?[0-9]{10,15}'))[1] as phone,
+                   m.text, m.date, c.title as chat_title
             FROM messages m
             JOIN chats c ON m.chat_id = c.id
-            WHERE m.user_id = %s AND (
+            WHERE m.user_id = $1 AND (
                 m.text ~ '\+?[0-9]{10,15}'
             )
             ORDER BY m.date DESC
             LIMIT 15
             """
             
-            df = pd.read_sql_query(query, conn, params=[user_id])
-            conn.close()
+            rows = await self.fetch(query, int(user_id), heavy=True)
+            await status
             
-            if df.empty:
-                await update.message.reply_text("❌ Nenhum telefone encontrado")
+            if not rows:
+                await message.reply_text("❌ Nenhum telefone encontrado")
                 return
             
-            response = f"📞 **{len(df)} PADRÕES ENCONTRADOS:**\n\n"
-            
-            for idx, row in df.iterrows():
-                phones = re.findall(r'(\+?[0-9]{10,15})', row['text'])
-                if phones:
-                    phone_info = f"**{idx+1}.** 📱 {phones[0]}\n💬 {row['text'][:60]}...\n📁 {row['chat_title']}\n\n"
-                    response += phone_info
+            response = f"📞 <b>{len(rows)} PADRÕES ENCONTRADOS:</b>\n\n" + "".join(
+                format_phone_row(idx, row) for idx, row in enumerate(rows)
+            )
             
-            await update.message.reply_text(response, parse_mode='Markdown')
+            await message.reply_text(response, parse_mode='HTML')
             
         except Exception as e:
-            conn.close()
-            await update.message.reply_text(f"❌ Erro: {str(e)}")
+            # O aviso precisa chegar antes da mensagem de erro
+            await asyncio.gather(status, return_exceptions=True)
+            await message.reply_text(f"❌ Erro: {str(e)}")
     
     async def analyze_network(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Analisar rede social"""
+        """Comando /network"""
         if not context.args:
-            await update.message.reply_text("❌ Use: `/network ID`", parse_mode='Markdown')
+            await update.message.reply_text("❌ Use: <code>/network ID</code>", parse_mode='HTML')
             return
         
-        user_id = context.args[0]
-        await update.message.reply_text(f"👥 Analisando rede...")
+        await self._do_network(update.message, context.args[0])
+    
+    async def _do_network(self, message, user_id):
+        """Analisar rede social"""
+        if not (user_id.isascii() and user_id.isdigit()):
+            await message.reply_text("❌ ID inválido")
+            return
         
-        conn = self.get_db_connection()
-        if not conn:
-            await update.message.reply_text("❌ Erro de conexão com o banco")
+        if not await self.ensure_pool():
+            await message.reply_text("❌ Erro de conexão com o banco")
             return
         
+        # Aviso enviado em paralelo com a consulta
+        status = asyncio.create_task(message.reply_text(f"👥 Analisando rede..."))
+        
         try:
             query = """
-            SELECT DISTINCT u.username, u.first_name, u.last_name,
+            WITH target_chats AS (
+                SELECT DISTINCT chat_id FROM messages WHERE user_id = $1
+            )
+            SELECT u.username, u.first_name, u.last_name,
                    COUNT(*) as msg_count
             FROM messages m
-            JOIN users u ON m.user_id = u.id  
-            WHERE m.chat_id IN (
-                SELECT DISTINCT chat_id FROM messages WHERE user_id = %s
-            )
-            AND m.user_id != %s
+            JOIN target_chats t ON m.chat_id = t.chat_id
+            JOIN users u ON m.user_id = u.id
+            WHERE m.user_id != $1
             GROUP BY u.id, u.username, u.first_name, u.last_name
             HAVING COUNT(*) > 2
             ORDER BY msg_count DESC
             LIMIT 10
             """
             
-            df = pd.read_sql_query(query, conn, params=[user_id, user_id])
-            conn.close()
+            rows = await self.fetch(query, int(user_id), heavy=True)
+            await status
             
-            if df.empty:
-                await update.message.reply_text("❌ Nenhuma conexão encontrada")
+            if not rows:
+                await message.reply_text("❌ Nenhuma conexão encontrada")
                 return
             
-            response = f"👥 **REDE SOCIAL - {len(df)} CONEXÕES:**\n\n"
-            
-            for idx, row in df.iterrows():
-                response += f"**{idx+1}.** @{row['username']} - {row['msg_count']} msgs\n"
+            response = f"👥 <b>REDE SOCIAL - {len(rows)} CONEXÕES:</b>\n\n" + "".join(
+                format_network_row(idx, row) for idx, row in enumerate(rows)
+            )
             
-            await update.message.reply_text(response, parse_mode='Markdown')
+            await message.reply_text(response, parse_mode='HTML')
             
         except Exception as e:
-            conn.close()
-            await update.message.reply_text(f"❌ Erro: {str(e)}")
+            # O aviso precisa chegar antes da mensagem de erro
+            await asyncio.gather(status, return_exceptions=True)
+            await message.reply_text(f"❌ Erro: {str(e)}")
     
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Lida com mensagens contendo @username"""
         text = update.message.text
-        usernames = re.findall(r'@(\w+)', text)
+        usernames = list(dict.fromkeys(MENTION_RE.findall(text)))
         
         if usernames:
-            for username in usernames[:2]:
-                await self.search_user_by_mention(update, username)
+            await self.search_users_by_mention(update, usernames[:10])
         else:
             await update.message.reply_text("💡 Digite @username ou use /search")
     
-    async def search_user_by_mention(self, update: Update, username: str):
-        """Busca rápida por menção"""
-        conn = self.get_db_connection()
-        if not conn:
+    async def search_users_by_mention(self, update: Update, usernames: list):
+        """Busca rápida por menções, em uma única consulta"""
+        if not await self.ensure_pool():
             return
         
         try:
-            query = "SELECT id, username FROM users WHERE username ILIKE %s LIMIT 3"
-            df = pd.read_sql_query(query, conn, params=[username])
-            conn.close()
+            query = """
+            SELECT t.mention, u.id, u.username
+            FROM unnest($1::text[]) AS t(mention)
+            JOIN LATERAL (
+                SELECT id, username FROM users WHERE username ILIKE t.mention LIMIT 3
+            ) u ON TRUE
+            """
+            rows = await self.fetch(query, tuple(usernames))
+            
+            found = {}
+            for row in rows:
+                found.setdefault(row['mention'], []).append(row)
             
-            if not df.empty:
-                response = f"🔍 **@{username} encontrado:**\n\n"
-                for _, row in df.iterrows():
-                    response += f"👤 @{row['username']}\n🆔 `{row['id']}`\n📊 `/analyze {row['id']}`\n\n"
-                await update.message.reply_text(response, parse_mode='Markdown')
+            response = "".join(
+                f"🔍 <b>@{esc(username)} encontrado:</b>\n\n"
+                + "".join(format_mention_row(row) for row in found[username])
+                for username in usernames
+                if username in found
+            )
+            if response:
+                await update.message.reply_text(response, parse_mode='HTML')
         except Exception as e:
-            conn.close()
+            logging.error(f"Erro DB: {e}")
     
     async def button_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handler de botões inline"""
         query = update.callback_query
         await query.answer()
         
-        data = query.data
-        
-        if data.startswith('analyze_'):
-            user_id = data.split('_')[1]
-            fake_update = type('', (), {})()
-            fake_update.message = query.message
-            fake_context = type('', (), {'args': [user_id]})()
-            await self.analyze_user(fake_update, fake_context)
-        
-        elif data.startswith('phones_'):
-            user_id = data.split('_')[1]
-            fake_update = type('', (), {})()
-            fake_update.message = query.message
-            fake_context = type('', (), {'args': [user_id]})()
-            await self.search_phones(fake_update, fake_context)
-        
-        elif data.startswith('network_'):
-            user_id = data.split('_')[1]
-            fake_update = type('', (), {})()
-            fake_update.message = query.message
-            fake_context = type('', (), {'args': [user_id]})()
-            await self.analyze_network(fake_update, fake_context)
+        action, _, user_id = query.data.partition('_')
+        handler = self.button_actions.get(action)
+        if handler:
+            await handler(query.message, user_id)
     
-    def run(self):
-        """Inicia o bot"""
-        self.application.run_polling()
+    async def run(self):
+        """Inicia o bot no loop do FastAPI (webhook ou polling)"""
+        try:
+            await self.application.initialize()
+            await self.open_pool()
+            await self.application.start()
+            if WEBHOOK_URL:
+                await self.application.bot.set_webhook(f"{WEBHOOK_URL}/webhook", secret_token=TG_SECRET)
+            else:
+                await self.application.updater.start_polling()
+        except Exception:
+            # Desfaz o que já foi iniciado antes de propagar o erro
+            await self.stop()
+            raise
+    
+    async def stop(self):
+        """Encerra o bot (também após um início parcial)"""
+        if self.application.updater.running:
+            await self.application.updater.stop()
+        if self.application.running:
+            await self.application.stop()
+        await self.application.shutdown()
+        await self.close_pool()
 
 # Global bot instance
 bot = None
 
-def start_bot():
-    """Inicia o bot em thread separada"""
-    global bot
+@app.post("/webhook")
+async def webhook(request: Request):
+    """Recebe updates do Telegram e os enfileira para o bot"""
+    if not (WEBHOOK_URL and bot):
+        raise HTTPException(status_code=404)
+    token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(token.encode(), TG_SECRET.encode()):
+        raise HTTPException(status_code=403)
+    
     try:
-        bot = TelegramInvestigatorBot(BOT_TOKEN)
-        logging.info("🤖 Bot iniciado no Railway")
-        bot.run()
-    except Exception as e:
-        logging.error(f"Erro no bot: {e}")
+        data = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        raise HTTPException(status_code=400)
+    if not isinstance(data, dict) or "update_id" not in data:
+        raise HTTPException(status_code=400)
+    
+    try:
+        update = Update.de_json(data, bot.application.bot)
+    except Exception:
+        raise HTTPException(status_code=400)
+    await bot.application.update_queue.put(update)
+    return {"ok": True}
 
 @app.on_event("startup")
 async def startup_event():
     """Inicia o bot quando o servidor inicia"""
-    if BOT_TOKEN:
-        Thread(target=start_bot, daemon=True).start()
-        logging.info("🚀 Servidor + Bot iniciados")
-    else:
+    global bot
+    if not BOT_TOKEN:
         logging.warning("⚠️ BOT_TOKEN não configurado")
+        return
+    
+    try:
+        bot = TelegramInvestigatorBot(BOT_TOKEN)
+        await bot.run()
+        logging.info("🚀 Servidor + Bot iniciados")
+    except Exception as e:
+        logging.error(f"Erro no bot: {e}")
+        bot = None
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Encerra o bot junto com o servidor"""
+    if bot:
+        await bot.stop()
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=PORT)
+    uvicorn.run(app, host="0.0.0.0", port=PORT, loop="uvloop", http="httptools")
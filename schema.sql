@@ -0,0 +1,16 @@
+-- Índices para as consultas do bot
+-- Aplicar uma vez: psql "$DATABASE_URL" -f schema.sql
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- /search e menções: username ILIKE $1
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_username_trgm
+    ON users USING GIN (username gin_trgm_ops);
+
+-- /analyze, /phones e /network: messages WHERE user_id = $1 (e chats do usuário)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS messages_user_id_chat_id
+    ON messages (user_id, chat_id);
+
+-- /network: mensagens dos chats do usuário
+CREATE INDEX CONCURRENTLY IF NOT EXISTS messages_chat_id
+    ON messages (chat_id);